@@ -1,121 +1,67 @@
+import contextlib
+import functools
+import http
 import http.server
+import io
+import multiprocessing
+import os
+import queue
+import runpy
+import shutil
+import socket
+import stat
 import subprocess
-from pathlib import Path
-from typing import Union
+import sys
+import threading
+import urllib.parse
+import wsgiref.util
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, ClassVar, Dict, Iterable, Iterator, Optional, Tuple, Union
 
-
-class ServerException(Exception):
-    pass
-
-
-class BaseCase:
-    @staticmethod
-    def handle_file(request_handler, full_path_to_file: Path):
-        try:
-            with open(full_path_to_file, 'r') as f:
-                content = f.read()
-            request_handler.send_content(content)
-        except IOError as msg:
-            msg = f"'{full_path_to_file}' cannot be read: {msg}"
-            request_handler.handle_error(msg)
-
-    @staticmethod
-    def index_path(request_handler):
-        return request_handler.full_path / 'index.html'
-
-    def test(self, request_handler):
-        raise NotImplementedError
-
-    def act(self, request_handler):
-        raise NotImplementedError
-
-
-class CaseNoFile(BaseCase):
-    """
-    File or directory does not exist.
-    """
-
-    def test(self, request_handler):
-        return not request_handler.full_path.exists()
-
-    def act(self, request_handler):
-        raise ServerException("f'{request_handler.path}' not found")
+if TYPE_CHECKING:
+    # Only defined on platforms with fork, so import it for annotations only.
+    from multiprocessing.context import ForkServerContext
 
 
-class CaseExistingFile(BaseCase):
-    """
-    File exists.
-    """
-
-    def test(self, request_handler):
-        return request_handler.full_path.is_file()
-
-    def act(self, request_handler):
-        self.handle_file(request_handler=request_handler, full_path_to_file=request_handler.full_path)
-
-
-class CaseAlwaysFail(BaseCase):
-    """
-    Base case if nothing else worked.
-    """
-
-    def test(self, request_handler):
-        return True
-
-    def act(self, request_handler):
-        raise ServerException(f"Unknown object '{request_handler.path}'")
+class ServerException(Exception):
+    def __init__(self, msg: str, status: int = 404) -> None:
+        super().__init__(msg)
+        self.status = status
 
 
-class CaseDirectoryIndexFile(BaseCase):
-    """
-    Serve index.html page if exists in directory.
+class RequestHandler(http.server.BaseHTTPRequestHandler):
     """
+    Handle HTTP requests by returning a fixed 'page'.
 
-    def test(self, request_handler):
-        return request_handler.full_path.is_dir() and self.index_path(request_handler).is_file()
-
-    def act(self, request_handler):
-        self.handle_file(request_handler=request_handler, full_path_to_file=self.index_path(request_handler))
-
-
-class CaseDirectoryNoIndexFile(BaseCase):
-    """
-    List contents of a directory.
     """
 
-    def test(self, request_handler):
-        return request_handler.full_path.is_dir() and not self.index_path(request_handler).is_file()
+    # Keep connections open between requests; every response sets Content-Length.
+    protocol_version = "HTTP/1.1"
 
-    def act(self, request_handler):
-        request_handler.list_directory_contents(full_path_to_directory=request_handler.full_path)
+    # Seconds an idle keep-alive connection may hold a worker thread.
+    timeout = 15
 
+    # Directory being served, resolved once instead of per request.
+    document_root: ClassVar[str] = os.path.realpath(os.getcwd())
 
-class CaseCGIFile(BaseCase):
-    """
-    Run python server side and return the results.
-    """
+    # Seconds a CGI script may hold a worker thread before it is killed.
+    cgi_timeout = 30
 
-    def test(self, request_handler):
-        return request_handler.full_path.is_file and str(request_handler.full_path).endswith('.py')
+    # Fork each CGI script from one pre-started interpreter where supported,
+    # so it skips interpreter startup but stays isolated and killable.
+    cgi_context: ClassVar[Optional['ForkServerContext']] = (
+        multiprocessing.get_context('forkserver') if 'forkserver' in multiprocessing.get_all_start_methods() else None
+    )
 
-    def act(self, request_handler):
-        request_handler.run_cgi_script(path_to_executable=request_handler.full_path)
+    # Set by do_GET for each request; declared so the handler types cleanly.
+    full_path: str
+    requested_file: str
+    response_started: bool
+    st_mode: Optional[int]
+    st_mtime_ns: int
 
-
-class RequestHandler(http.server.BaseHTTPRequestHandler):
-    """
-    Handle HTTP requests by returning a fixed 'page'.
-
-    """
-
-    cases = [
-        CaseCGIFile,
-        CaseNoFile,
-        CaseExistingFile,
-        CaseDirectoryIndexFile,
-        CaseDirectoryNoIndexFile,
-        CaseAlwaysFail
-    ]
+    # Buffer writes so headers and body are not sent one syscall per write.
+    wbufsize = -1
 
     error_page = """
         <html>
@@ -126,12 +72,14 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         </html>
         """
 
-    # How to display a directory listing.
-    directory_listing_page = """
+    # How to display a directory listing; entries go in between.
+    directory_listing_head: ClassVar[bytes] = b"""
         <html>
         <body>
         <ul>
-        {0}
+        """
+
+    directory_listing_tail: ClassVar[bytes] = b"""
         </ul>
         </body>
         </html>
@@ -139,51 +87,332 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
 
     # Handle a GET request.
     def do_GET(self) -> None:
+        self.response_started = False
         try:
             # Figure out what exactly is being requested.
-            self.full_path = Path.cwd() / self.path[1:]
+            relative_path = self.requested_path().lstrip('/')
+            self.requested_file = os.path.join(self.document_root, relative_path)
+            self.full_path = os.path.realpath(self.requested_file)
+            if os.path.commonpath([self.document_root, self.full_path]) != self.document_root:
+                raise ServerException(f"'{self.path}' is outside the served directory", 403)
+
+            # Stat the target once; dispatch inspects the cached mode.
+            try:
+                st = os.stat(self.full_path)
+                self.st_mode = st.st_mode
+                self.st_mtime_ns = st.st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                self.st_mode = None
+                self.st_mtime_ns = 0
 
             # Figure out how to handle it.
-            for case in self.cases:
-                _case = case()
-                if _case.test(self):
-                    _case.act(self)
-                    break
+            self.dispatch()
 
         # Handle errors.
         except Exception as msg:
-            self.handle_error(msg)
-
-    def run_cgi_script(self, path_to_executable: Path) -> None:
-        cmd = "python " + str(path_to_executable)
-        result = subprocess.run(cmd.split(' '), stdout=subprocess.PIPE)
-        self.send_content(str(result.stdout))
-
-    def list_directory_contents(self, full_path_to_directory: Path) -> None:
+            # Once headers are out, an error page would be read as body bytes.
+            if self.response_started:
+                self.close_connection = True
+                raise
+            self.handle_error(msg, msg.status if isinstance(msg, ServerException) else 404)
+
+    # The percent-decoded path part of the request target.
+    def requested_path(self) -> str:
+        return urllib.parse.unquote(self.path.split('?', 1)[0], errors='surrogateescape')
+
+    # Pick how to serve the target from its cached mode, in one branch chain.
+    def dispatch(self) -> None:
+        mode = self.st_mode
+        if mode is None:
+            raise ServerException(f"'{self.path}' not found")
+        elif stat.S_ISREG(mode):
+            # Run python server side and return the results; the requested
+            # name decides, not the target a symlink resolves to.
+            if self.requested_file.endswith('.py'):
+                self.run_cgi_script(path_to_executable=self.full_path)
+            else:
+                self.handle_file(full_path_to_file=self.full_path)
+        elif stat.S_ISDIR(mode):
+            # Serve index.html if the directory has one, else list its contents.
+            index_path = os.path.join(self.full_path, 'index.html')
+            if os.path.isfile(index_path):
+                self.handle_file(full_path_to_file=index_path)
+            else:
+                self.list_directory_contents(full_path_to_directory=self.full_path)
+        else:
+            raise ServerException(f"Unknown object '{self.path}'")
+
+    def handle_file(self, full_path_to_file: str) -> None:
+        try:
+            f = open(full_path_to_file, 'rb')
+        except IOError as msg:
+            error_msg = f"'{full_path_to_file}' cannot be read: {msg}"
+            self.handle_error(error_msg)
+            return
+        # send_file takes ownership of f and closes it once the body is sent.
+        self.send_file(f, os.fstat(f.fileno()).st_size)
+
+    def run_cgi_script(self, path_to_executable: str) -> None:
+        if self.cgi_context is not None:
+            self.send_content(self.run_cgi_script_forked(self.cgi_context, path_to_executable))
+            return
+        result = subprocess.run([sys.executable, path_to_executable], stdout=subprocess.PIPE, check=False,
+                                timeout=self.cgi_timeout)
+        self.send_content(result.stdout)
+
+    def run_cgi_script_forked(self, cgi_context: 'ForkServerContext', path_to_executable: str) -> bytes:
+        receiver, sender = cgi_context.Pipe(duplex=False)
+        process = cgi_context.Process(target=run_cgi_script_in_worker, args=(path_to_executable, sender), daemon=True)
+        process.start()
+        sender.close()
+        output: Optional[bytes] = None
+        with receiver:
+            finished = receiver.poll(self.cgi_timeout)
+            if finished:
+                try:
+                    output = receiver.recv_bytes()
+                except EOFError:
+                    # The child died without reporting, e.g. via os._exit().
+                    pass
+        # Let a finished child unwind so a traceback reaches stderr; kill a stuck one.
+        process.join(self.cgi_timeout if finished else 0)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        if not finished:
+            raise ServerException(f"'{self.path}' timed out after {self.cgi_timeout} seconds")
+        if output is None:
+            raise ServerException(f"'{self.path}' exited with code {process.exitcode} before producing output")
+        if process.exitcode != 0:
+            self.log_error("CGI script '%s' exited with code %s", self.path, process.exitcode)
+        return output
+
+    def list_directory_contents(self, full_path_to_directory: str) -> None:
         try:
-            contents = full_path_to_directory.glob('**/*')
-            bullets = ['<li>{0}</li>'.format(file) for file in contents if not str(file).startswith('.')]
-            page = self.directory_listing_page.format('\n'.join(bullets))
-            self.send_content(page)
+            page = self.build_directory_listing(full_path_to_directory, self.st_mtime_ns)
         except OSError as msg:
-            msg = f"'{self.path}' cannot be listed: {msg}"
-            self.handle_error(msg)
+            error_msg = f"'{self.path}' cannot be listed: {msg}"
+            self.handle_error(error_msg)
+            return
+        self.send_content(page)
+
+    # Listings are cached per directory until its mtime changes.
+    @classmethod
+    @functools.lru_cache(maxsize=128)
+    def build_directory_listing(cls, full_path_to_directory: str, mtime_ns: int) -> bytes:
+        page = io.BytesIO()
+        page.write(cls.directory_listing_head)
+        # Scanning a bytes path yields bytes names, so bullets need no formatting or encoding.
+        with os.scandir(os.fsencode(full_path_to_directory)) as entries:
+            page.writelines(b'<li>' + entry.name + b'</li>\n' for entry in entries if not entry.name.startswith(b'.'))
+        page.write(cls.directory_listing_tail)
+        return page.getvalue()
 
     # Handle unknown objects.
-    def handle_error(self, msg: Union[str, Exception]) -> None:
-        content = self.error_page.format(path=self.path, msg=msg)
-        self.send_content(content, 404)
+    def handle_error(self, msg: Union[str, Exception], status: int = 404) -> None:
+        content = self.error_page.format(path=self.path, msg=msg).encode()
+        self.send_content(content, status)
+
+    # Send actual content; Content-Length counts bytes, not characters.
+    def send_content(self, content: Union[str, bytes], status: int = 200) -> None:
+        if isinstance(content, str):
+            content = content.encode()
+        with self.corked():
+            self.send_response(status)
+            self.send_header("Content-type", "text/html")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    # Send a file straight from the page cache to the socket.
+    def send_file(self, f: BinaryIO, size: int, status: int = 200) -> None:
+        with f, self.corked():
+            self.send_response(status)
+            self.send_header("Content-type", "text/html")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            self.wfile.flush()
+            if hasattr(self.request, 'sendfile'):
+                self.request.sendfile(f, 0, size)
+            else:
+                shutil.copyfileobj(f, self.wfile)
+
+    def end_headers(self) -> None:
+        super().end_headers()
+        self.response_started = True
+
+    # Hold back partial TCP segments so headers and body leave together.
+    @contextlib.contextmanager
+    def corked(self) -> Iterator[None]:
+        if not hasattr(socket, 'TCP_CORK'):
+            yield
+            return
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            yield
+            self.wfile.flush()
+        finally:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+
+class WSGIRequest(RequestHandler):
+    """
+    Serve one WSGI request with the same dispatch as RequestHandler.
+
+    Only the transport differs: responses go through start_response, and
+    files are returned via wsgi.file_wrapper so the host server can send
+    them with its own sendfile path. There is no socket, so every inherited
+    method that would touch one (sending, errors, logging) is overridden.
+    CGI scripts still run through cgi_context, so the host process starts
+    its own fork server on the first CGI request.
+    """
+
+    def __init__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> None:
+        self.environ = environ
+        self.start_response = start_response
+        self.path = environ.get('PATH_INFO') or '/'
+        self.body: Iterable[bytes] = []
+
+    def requested_path(self) -> str:
+        # WSGI servers have already split off the query and percent-decoded
+        # PATH_INFO, but carry its raw bytes as latin-1.
+        return self.path.encode('latin-1').decode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def status_line(status: int) -> str:
+        return f"{status} {http.HTTPStatus(status).phrase}"
+
+    def send_content(self, content: Union[str, bytes], status: int = 200) -> None:
+        if isinstance(content, str):
+            content = content.encode()
+        self.start_response(self.status_line(status), [
+            ("Content-type", "text/html"),
+            ("Content-Length", str(len(content))),
+        ])
+        self.response_started = True
+        self.body = [content]
+
+    def send_file(self, f: BinaryIO, size: int, status: int = 200) -> None:
+        self.start_response(self.status_line(status), [
+            ("Content-type", "text/html"),
+            ("Content-Length", str(size)),
+        ])
+        self.response_started = True
+        file_wrapper = self.environ.get('wsgi.file_wrapper', wsgiref.util.FileWrapper)
+        self.body = file_wrapper(f)
+
+    def send_error(self, code: int, message: Optional[str] = None, explain: Optional[str] = None) -> None:
+        content = self.error_page.format(path=self.path, msg=message or http.HTTPStatus(code).phrase)
+        self.send_content(content, code)
+
+    @contextlib.contextmanager
+    def corked(self) -> Iterator[None]:
+        yield
+
+    def log_message(self, format: str, *args: Any) -> None:
+        self.environ['wsgi.errors'].write(f"{self.path}: {format % args}\n")
+
+
+def application(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+    """
+    WSGI entry point, e.g. `gunicorn 'mini-web-server:application'`.
+    """
+    if environ.get('REQUEST_METHOD', 'GET') != 'GET':
+        start_response(WSGIRequest.status_line(501), [("Content-Length", "0")])
+        return []
+    request = WSGIRequest(environ, start_response)
+    request.do_GET()
+    return request.body
+
+
+def run_cgi_script_in_worker(path_to_executable: str, sender: Connection) -> None:
+    """
+    Run a CGI script in a forked child and send back what it printed.
+
+    Output is sent even if the script raises, matching the subprocess path.
+    """
+    # Set up the script's environment the way `python script.py` does.
+    sys.argv = [path_to_executable]
+    sys.path.insert(0, os.path.dirname(path_to_executable))
+    buffer = io.BytesIO()
+    stdout = io.TextIOWrapper(buffer, write_through=True)
+    try:
+        with contextlib.redirect_stdout(stdout):
+            runpy.run_path(path_to_executable, run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        # Detach so the wrapper cannot close the buffer before it is read.
+        stdout.detach()
+        sender.send_bytes(buffer.getvalue())
+        sender.close()
+
+
+class PooledHTTPServer(http.server.ThreadingHTTPServer):
+    """
+    Serve requests concurrently on a bounded pool of worker threads.
+
+    A worker stays with its connection until the client closes it or it
+    sits idle for RequestHandler.timeout seconds, so max_workers idle
+    keep-alive clients can occupy the whole pool. Up to max_queued more
+    accepted connections wait for a free worker; beyond that new
+    connections are refused with 503 instead of piling up unbounded.
+    Workers are daemon threads, so stopping the server never waits on
+    an idle client or a running CGI script.
+    """
 
-    # Send actual content.
-    def send_content(self, content: str, status: int = 200):
-        self.send_response(status)
-        self.send_header("Content-type", "text/html")
-        self.send_header("Content-Length", str(len(content)))
-        self.end_headers()
-        self.wfile.write(str.encode(content))
+    allow_reuse_address = True
+
+    # Upper bound on concurrently handled requests, like Apache's MaxClients.
+    max_workers = 32
+
+    # Accepted connections allowed to wait for a worker before refusing.
+    max_queued = 64
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # Start the CGI fork server now, before any request threads exist.
+        cgi_context = getattr(self.RequestHandlerClass, 'cgi_context', None)
+        if cgi_context is not None:
+            warm_up = cgi_context.Process(target=int)
+            warm_up.start()
+            warm_up.join()
+        self.slots = threading.BoundedSemaphore(self.max_workers + self.max_queued)
+        self.pending: 'queue.SimpleQueue[Tuple[Any, Any]]' = queue.SimpleQueue()
+        for _ in range(self.max_workers):
+            threading.Thread(target=self.serve_pending, daemon=True).start()
+
+    def process_request(self, request: Union[socket.socket, Tuple[bytes, socket.socket]], client_address: Any) -> None:
+        if not self.slots.acquire(blocking=False):
+            self.refuse_request(request)
+            return
+        self.pending.put((request, client_address))
+
+    # Worker loop: handle queued connections one at a time.
+    def serve_pending(self) -> None:
+        while True:
+            request, client_address = self.pending.get()
+            try:
+                self.process_request_thread(request, client_address)
+            finally:
+                self.slots.release()
+
+    # Tell the client the server is full rather than queueing it forever.
+    def refuse_request(self, request: Union[socket.socket, Tuple[bytes, socket.socket]]) -> None:
+        if isinstance(request, socket.socket):
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+        self.shutdown_request(request)
 
 
 if __name__ == '__main__':
     serverAddress = ('', 8080)
-    server = http.server.HTTPServer(serverAddress, RequestHandler)
-    server.serve_forever()
+    server = PooledHTTPServer(serverAddress, RequestHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()